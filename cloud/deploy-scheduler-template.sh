@@ -145,6 +145,7 @@ gcloud run deploy ${SERVICE_NAME} \
   --ingress=all `# Or internal / internal-and-cloud-load-balancing` \
   --no-allow-unauthenticated `# Require authentication` \
   --port=8080 `# Port exposed in Dockerfile` \
+  --no-cpu-throttling `# /run returns 202 and keeps fetching in the background` \
   --set-env-vars="${RUN_ENV_VARS}" \
   --project=${PROJECT_ID} --quiet
 
@@ -1,7 +1,9 @@
 import streamlit as st
 import time
 import json
+import mmap
 import os
+import orjson
 import logging
 import sys
 import subprocess
@@ -25,6 +27,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ---- Constants ----
+DATA_CACHE_TTL_SECONDS = 300 # Widget reruns reuse the disk scan; new fetcher output shows up within this window
+LAST_RUN_MARKER = ".last_run" # Written by data_fetcher with the fetch_timestamp of its last completed run
+
 # ---- Container Startup Logs ----
 logger.info("Starting Kalshi Dashboard")
 logger.info("Environment: %s", "PROD" if os.getenv('PROD_KEYID') else "DEMO")
@@ -46,7 +52,28 @@ def access_secret_version(secret_id, version_id="latest"):
         st.stop()
 
 # ---- Data Loading Functions ----
-@st.cache_data
+def read_latest_record(file_path):
+    """Return the last snapshot in an NDJSON history file (None if empty), without reading the whole file."""
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = len(mm) - 1 if mm[-1:] == b"\n" else len(mm)
+            start = mm.rfind(b"\n", 0, end) + 1
+            return orjson.loads(mm[start:end])
+
+def read_market_file(file_path):
+    """Load the latest market snapshot from a .ndjson history or a legacy .json file."""
+    if file_path.endswith(".ndjson"):
+        return read_latest_record(file_path)
+    with open(file_path, 'rb') as f:
+        market_data = orjson.loads(f.read())
+    # Legacy histories are a JSON list of snapshots, oldest first
+    if isinstance(market_data, list):
+        return market_data[-1] if market_data else None
+    return market_data
+
+@st.cache_data(ttl=DATA_CACHE_TTL_SECONDS)
 def load_markets_from_disk(data_dir="/app/market_data"):
     """Load market data from structured JSON files in the specified directory."""
     all_markets = []
@@ -55,13 +82,15 @@ def load_markets_from_disk(data_dir="/app/market_data"):
 
     for root, dirs, files in os.walk(data_dir):
         for file in files:
-            if file.endswith(".json"):
+            if file.endswith((".json", ".ndjson")) and not file.startswith(("_", ".")): # Skip fetcher bookkeeping files
+                if file.endswith(".json") and file[:-len(".json")] + ".ndjson" in files:
+                    continue # Legacy copy of a history that has moved to NDJSON
                 file_path = os.path.join(root, file)
                 try:
-                    with open(file_path, 'r') as f:
-                        market_data = json.load(f)
+                    market_data = read_market_file(file_path)
+                    if market_data is not None:
                         all_markets.append(market_data)
-                except json.JSONDecodeError as e:
+                except json.JSONDecodeError as e: # Also catches orjson.JSONDecodeError
                     logger.error(f"Failed to load JSON from {file_path}: {e}")
                 except Exception as e:
                     logger.error(f"Error reading file {file_path}: {e}")
@@ -71,7 +100,7 @@ def load_markets_from_disk(data_dir="/app/market_data"):
     return all_markets
 
 
-@st.cache_data
+@st.cache_data(ttl=DATA_CACHE_TTL_SECONDS)
 def check_data_freshness(data_dir="/app/market_data", freshness_threshold_hours=1):
     """Check if market data in data_dir is fresh based on fetch_timestamp."""
     logger.info(f"Checking data freshness in: {data_dir}")
@@ -79,23 +108,37 @@ def check_data_freshness(data_dir="/app/market_data", freshness_threshold_hours=
         logger.info(f"Data directory '{data_dir}' is empty or does not exist, data is not fresh.")
         return False
 
-    latest_fetch_timestamp = None
-    for root, dirs, files in os.walk(data_dir):
-        for file in files:
-            if file.endswith(".json"):
-                file_path = os.path.join(root, file)
-                try:
-                    with open(file_path, 'r') as f:
-                        market_data = json.load(f)
+    # Unchanged markets aren't rewritten, so their fetch_timestamp lags behind healthy runs;
+    # prefer the fetcher's run marker and only scan the snapshots when it is missing
+    latest_timestamp_str = None
+    try:
+        with open(os.path.join(data_dir, LAST_RUN_MARKER)) as f:
+            latest_timestamp_str = f.read().strip() or None
+    except OSError:
+        pass
+
+    if latest_timestamp_str is None:
+        # fetch_timestamp is fixed-width ISO 8601 UTC ('%Y-%m-%dT%H:%M:%SZ'), so string order is time
+        # order: track the newest string and parse only that one
+        for root, dirs, files in os.walk(data_dir):
+            for file in files:
+                if file.endswith((".json", ".ndjson")):
+                    file_path = os.path.join(root, file)
+                    try:
+                        market_data = read_market_file(file_path) or {}
                         timestamp_str = market_data.get('fetch_timestamp')
-                        if timestamp_str:
-                            # Parse the string and make it timezone-aware (UTC)
-                            naive_dt = datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%SZ')
-                            file_fetch_time = naive_dt.replace(tzinfo=timezone.utc)
-                            if latest_fetch_timestamp is None or file_fetch_time > latest_fetch_timestamp:
-                                latest_fetch_timestamp = file_fetch_time
-                except Exception as e:
-                    logger.error(f"Error reading timestamp from {file_path}: {e}")
+                        if timestamp_str and (latest_timestamp_str is None or timestamp_str > latest_timestamp_str):
+                            latest_timestamp_str = timestamp_str
+                    except Exception as e:
+                        logger.error(f"Error reading timestamp from {file_path}: {e}")
+
+    latest_fetch_timestamp = None
+    if latest_timestamp_str:
+        try:
+            # Parse the string and make it timezone-aware (UTC)
+            latest_fetch_timestamp = datetime.strptime(latest_timestamp_str, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+        except ValueError as e:
+            logger.error(f"Unparseable fetch_timestamp {latest_timestamp_str!r}: {e}")
 
     if latest_fetch_timestamp:
         hours_diff = (datetime.now(timezone.utc) - latest_fetch_timestamp).total_seconds() / 3600
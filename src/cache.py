@@ -0,0 +1,69 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# ---- Configuration ----
+CACHE_DIR_ENV = "KALSHI_CACHE_DIR" # Caching is off unless this points at a directory (e.g. .cache)
+
+class FileCache:
+    """JSON response cache stored as <root>/<endpoint>/<md5(params)>.json."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, endpoint: str, key: str) -> str:
+        return os.path.join(self.root, endpoint, hashlib.md5(key.encode('utf-8')).hexdigest() + ".json")
+
+    def get(self, endpoint: str, key: str, ttl: float):
+        """Return (True, response) for an entry younger than ttl seconds, else (False, None)."""
+        try:
+            with open(self._path(endpoint, key), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return False, None
+        if time.time() - entry.get('timestamp', 0) > ttl:
+            return False, None
+        return True, entry.get('response')
+
+    def set(self, endpoint: str, key: str, response) -> None:
+        """Store response, replacing the file atomically so concurrent readers never see a partial write."""
+        path = self._path(endpoint, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'timestamp': time.time(), 'response': response}, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+@functools.lru_cache(maxsize=None)
+def _cache_for(root: str) -> FileCache:
+    return FileCache(root)
+
+def get_cache():
+    """Return the FileCache configured by KALSHI_CACHE_DIR, or None when caching is disabled."""
+    root = os.getenv(CACHE_DIR_ENV)
+    return _cache_for(root) if root else None
+
+def cached(ttl: float):
+    """Cache a KalshiHttpClient method's JSON result on disk for ttl seconds, keyed by environment and arguments."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = get_cache()
+            if cache is None:
+                return method(self, *args, **kwargs)
+            key = json.dumps([self.environment.value, args, kwargs], sort_keys=True, default=str)
+            hit, response = cache.get(method.__name__, key, ttl)
+            if hit:
+                return response
+            response = method(self, *args, **kwargs)
+            cache.set(method.__name__, key, response)
+            return response
+        return wrapper
+    return decorator
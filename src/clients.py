@@ -1,12 +1,15 @@
 import requests
 import base64
 import time
+import threading
 from typing import Any, Dict, Optional
 from datetime import datetime, timedelta
 from enum import Enum
 import json
+import logging
 import os
 
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
 
 from cryptography.hazmat.primitives import serialization, hashes
@@ -15,6 +18,10 @@ from cryptography.exceptions import InvalidSignature
 
 import websockets
 
+from src.cache import cached
+
+logger = logging.getLogger(__name__)
+
 class Environment(Enum):
     DEMO = "demo"
     PROD = "prod"
@@ -30,6 +37,9 @@ class KalshiBaseClient:
         self.private_key = private_key
         self.environment = environment
         self.last_api_call = datetime.now()
+        # Signing parameters are the same for every request, so build them once
+        self._pss_padding = padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.DIGEST_LENGTH)
+        self._sign_hash = hashes.SHA256()
 
         if self.environment == Environment.DEMO:
             self.HTTP_BASE_URL = os.environ.get("DEMO_HTTP_BASE_URL", "https://demo-api.kalshi.co")
@@ -43,45 +53,31 @@ class KalshiBaseClient:
     def request_headers(self, method: str, path: str) -> Dict[str, Any]:
         current_time_milliseconds = int(time.time() * 1000)
         timestamp_str = str(current_time_milliseconds)
-        
-        import logging
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.DEBUG)
-        self.logger.debug("=== Debug: Signature Components ===")
-        self.logger.debug(f"Timestamp: {timestamp_str}")
-        self.logger.debug(f"Method: {method}")
-        self.logger.debug(f"Path: {path}")
 
         path_parts = path.split('?')
         msg_string = timestamp_str + method + path_parts[0]
-        print(f"Message String: {msg_string}")
-        
         signature = self.sign_pss_text(msg_string)
-        print(f"Signature: {signature[:50]}...")  # Print first 50 chars of signature
+        logger.debug("Signed %s %s at %s: %s...", method, path, timestamp_str, signature[:50])
 
-        headers = {
+        return {
             "Content-Type": "application/json",
             "KALSHI-ACCESS-KEY": self.key_id,
             "KALSHI-ACCESS-SIGNATURE": signature,
             "KALSHI-ACCESS-TIMESTAMP": timestamp_str,
         }
-        
-        print("\n=== Request Headers ===")
-        for k, v in headers.items():
-            print(f"{k}: {v[:100]}{'...' if len(v) > 100 else ''}")  # Truncate long values
-        
-        return headers
 
     def sign_pss_text(self, text: str) -> str:
         message = text.encode('utf-8')
-        signature = self.private_key.sign(
-            message,
-            padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.DIGEST_LENGTH),
-            hashes.SHA256()
-        )
+        signature = self.private_key.sign(message, self._pss_padding, self._sign_hash)
         return base64.b64encode(signature).decode('utf-8')
 
 class KalshiHttpClient(KalshiBaseClient):
+    REQUESTS_PER_SECOND = 10 # Same average rate as the old fixed 100 ms gap between calls
+    MAX_RETRIES = 3 # Extra attempts for connection errors and RETRY_STATUSES responses
+    RETRY_BACKOFF_SECONDS = 0.3 # Doubled after each attempt unless the server sends Retry-After
+    RETRY_STATUSES = (429, 502, 503, 504)
+    MAX_RETRY_DELAY_SECONDS = 30 # Cap on any single wait, including a server-supplied Retry-After
+
     def __init__(
         self,
         key_id: str,
@@ -96,27 +92,74 @@ class KalshiHttpClient(KalshiBaseClient):
         self.series_url = "/trade-api/v2/series"
         self.events_url = "/trade-api/v2/events"
 
+        # One pooled keep-alive session per client so repeated calls skip the TCP/TLS handshake
+        self.session = requests.Session()
+        self.session.headers['Connection'] = 'keep-alive'
+        # Retries are handled in get() rather than by the adapter, so every attempt is re-signed
+        # and goes through rate_limit()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._rate_limit_lock = threading.Lock() # Client may be shared by several fetch threads
+        self._tokens = float(self.REQUESTS_PER_SECOND)
+        self._tokens_updated = time.monotonic()
+
+    def get_session(self) -> requests.Session:
+        """Return the pooled session shared by all requests from this client (e.g. to mount a custom HTTPAdapter)."""
+        return self.session
+
     def rate_limit(self) -> None:
-        THRESHOLD_IN_MILLISECONDS = 100
-        now = datetime.now()
-        threshold_in_seconds = THRESHOLD_IN_MILLISECONDS / 1000
-        if (now - self.last_api_call).total_seconds() * 1000 < THRESHOLD_IN_MILLISECONDS:
-            time.sleep(threshold_in_seconds)
-        self.last_api_call = datetime.now()
+        """Token bucket: average REQUESTS_PER_SECOND, bursting up to that many calls when there's headroom."""
+        with self._rate_limit_lock:
+            now = time.monotonic()
+            self._tokens = min(self.REQUESTS_PER_SECOND, self._tokens + (now - self._tokens_updated) * self.REQUESTS_PER_SECOND)
+            self._tokens_updated = now
+            if self._tokens < 1:
+                # Sleeping under the lock keeps waiting threads queued in order
+                time.sleep((1 - self._tokens) / self.REQUESTS_PER_SECOND)
+                self._tokens_updated = time.monotonic()
+                self._tokens = 0
+            else:
+                self._tokens -= 1
+            self.last_api_call = datetime.now()
+
+    def retry_delay(self, response: requests.Response, attempt: int) -> float:
+        """Seconds to wait before retrying response: the server's Retry-After if given, else exponential backoff.
+
+        Clamped to MAX_RETRY_DELAY_SECONDS so one bad header can't stall a fetch worker.
+        """
+        try:
+            delay = float(response.headers.get('Retry-After', ''))
+        except ValueError:
+            delay = self.RETRY_BACKOFF_SECONDS * 2 ** attempt
+        return min(max(0.0, delay), self.MAX_RETRY_DELAY_SECONDS)
 
     def raise_if_bad_response(self, response: requests.Response) -> None:
         if not 200 <= response.status_code < 300:
             response.raise_for_status()
 
     def get(self, path: str, params: Dict[str, Any] = {}, verbose=False) -> Any:
-        self.rate_limit()
         print(f"\n=== Sending GET Request ===")
         print(f"Full URL: {self.host}{path}")
-        response = requests.get(
-            self.host + path,
-            headers=self.request_headers("GET", path),
-            params=params
-        )
+        for attempt in range(self.MAX_RETRIES + 1):
+            # Signatures are timestamped, so each attempt is re-signed as well as rate limited
+            self.rate_limit()
+            try:
+                response = self.session.get(
+                    self.host + path,
+                    headers=self.request_headers("GET", path),
+                    params=params
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                logger.debug("GET %s failed (attempt %s), retrying: %s", path, attempt + 1, e)
+                time.sleep(self.RETRY_BACKOFF_SECONDS * 2 ** attempt)
+                continue
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.MAX_RETRIES:
+                break
+            logger.debug("GET %s returned %s (attempt %s), retrying", path, response.status_code, attempt + 1)
+            time.sleep(self.retry_delay(response, attempt))
         self.raise_if_bad_response(response)
         if verbose:
             print(f"\n=== Raw Response ===")
@@ -249,6 +292,23 @@ class KalshiHttpClient(KalshiBaseClient):
         }
         return self._get(f"{self.markets_url}/orderbook", params=params)
 
+class CachedKalshiHttpClient(KalshiHttpClient):
+    """KalshiHttpClient whose market reads are cached on disk when KALSHI_CACHE_DIR is set (see src/cache.py).
+
+    For tests and dev tooling only; the data fetcher uses KalshiHttpClient so it never saves stale markets.
+    """
+    @cached(ttl=3600)
+    def get_market(self, *args, **kwargs):
+        return super().get_market(*args, **kwargs)
+
+    @cached(ttl=3600)
+    def get_markets(self, *args, **kwargs):
+        return super().get_markets(*args, **kwargs)
+
+    @cached(ttl=86400)
+    def get_market_history(self, *args, **kwargs):
+        return super().get_market_history(*args, **kwargs)
+
 class KalshiWebSocketClient(KalshiBaseClient):
     def __init__(
         self,
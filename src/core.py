@@ -2,9 +2,9 @@ import os
 from dotenv import load_dotenv
 import asyncio
 import time
-from threading import Thread
-from cryptography.hazmat.primitives import serialization
+from threading import Lock, Thread
 from src.clients import KalshiHttpClient, KalshiWebSocketClient, Environment
+from src.key_loader import load_key
 
 load_dotenv()
 
@@ -12,29 +12,46 @@ load_dotenv()
 env = Environment.DEMO
 key_id = os.getenv('DEMO_KEYID')
 keyfile_path = os.getenv('DEMO_KEYFILE')
-keyfile_path = os.path.expanduser(keyfile_path)
 
-# Load private key
+# Load private key and initialize clients, skipping both when credentials aren't configured
 private_key = None  # Initialize private_key
-try:
-    with open(keyfile_path, "rb") as key_file:
-        private_key = serialization.load_pem_private_key(
-            key_file.read(),
-            password=None
-        )
-except Exception as e:
-    print(f"Error loading private key: {e}")
-    private_key = None
-
-
-# Initialize clients
-http_client = KalshiHttpClient(key_id, private_key, env)
-ws_client = KalshiWebSocketClient(key_id, private_key, env)
-
-# WebSocket thread starter
+http_client = None
+ws_client = None
+if not (key_id and keyfile_path):
+    print(f"Skipping {env.value} client setup: DEMO_KEYID/DEMO_KEYFILE not configured")
+else:
+    try:
+        private_key = load_key(keyfile_path)
+    except Exception as e:
+        print(f"Error loading private key: {e}")
+        private_key = None
+
+    http_client = KalshiHttpClient(key_id, private_key, env)
+    ws_client = KalshiWebSocketClient(key_id, private_key, env)
+
+# WebSocket runner: one long-lived event loop thread, reused by every start_ws() call
+_ws_loop = None
+_ws_loop_lock = Lock()
+_ws_future = None
+_ws_start_lock = Lock()
+
+def get_ws_loop():
+    """Return the background event loop for WebSocket work, starting it on first use."""
+    global _ws_loop
+    with _ws_loop_lock:
+        if _ws_loop is None:
+            _ws_loop = asyncio.new_event_loop()
+            Thread(target=_ws_loop.run_forever, daemon=True).start()
+    return _ws_loop
+
 def start_ws():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(ws_client.connect())
+    """Connect ws_client on the shared loop; calls while a connection is running (or without credentials) are no-ops."""
+    global _ws_future
+    if ws_client is None:
+        return None
+    with _ws_start_lock:
+        if _ws_future is None or _ws_future.done():
+            _ws_future = asyncio.run_coroutine_threadsafe(ws_client.connect(), get_ws_loop())
+    return _ws_future
 
-# Thread(target=start_ws, daemon=True).start()
+# start_ws()
@@ -1,18 +1,20 @@
 import os
+import io
+import gzip
+import hashlib
 import logging
+import signal
 import sys
-import json
+import time
+import threading
+import orjson
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from dotenv import load_dotenv # Keep for local mode
-from cryptography.hazmat.primitives import serialization
-import google.cloud.secretmanager as secretmanager
-from google.cloud import storage # Added for GCS
 from flask import Flask, request, jsonify # Added for Flask
-import traceback # Import traceback
-
-print("--- data_fetcher.py START ---", flush=True) # <<< ADDED
 
 from src.clients import KalshiHttpClient, Environment, detect_ticker_type
+from src.key_loader import load_key, load_private_key
 
 # ---- Configuration ----
 load_dotenv() # Load .env file for local development
@@ -31,36 +33,81 @@ LOCAL_MODE = os.getenv("LOCAL_MODE", "false").lower() == "true"
 MARKET_DATA_DIR = "market_data" # Used only in local mode
 GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "kalshi-market-data-storage") # Get from env var
 GCS_BASE_PATH = "market_data" # Base 'folder' in GCS
+GCS_UPLOAD_MAX_WORKERS = 16 # Threads used by the run's single batched GCS upload (also the storage client's pool size)
+GCS_UPLOAD_TIMEOUT_SECONDS = 5 # Fail fast; the next scheduled run rewrites the blob anyway
+GCS_BATCH_SIZE = 100 # Max requests per GCS batch call
+HISTORY_COMPOSE_ATTEMPTS = 3 # Generation-conditional append attempts before giving up on a market
+MARKET_HASH_MANIFEST = "fetcher_state/market_hashes.json" # Last saved snapshot hash per market, kept across instances (outside GCS_BASE_PATH, which the dashboard mirrors)
+LEGACY_MARKET_HASH_MANIFEST = f"{GCS_BASE_PATH}/_market_hashes.json" # Read once if MARKET_HASH_MANIFEST doesn't exist yet
+MAX_TRACKED_MARKET_HASHES = 50000 # Least recently seen entries are evicted beyond this
+LAST_RUN_MARKER = ".last_run" # fetch_timestamp of the last completed run, read by the dashboard's freshness check
 TICKER_FILE = "tickers.txt" # Assumed to be in the container's working directory
+MARKET_TICKER_BATCH_SIZE = 50 # Market tickers per comma-separated get_markets call
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "16")) # Tickers processed concurrently
+SECRET_CACHE_TTL_SECONDS = int(os.getenv("SECRET_CACHE_TTL_SECONDS", "3600")) # Secrets are re-read from Secret Manager at most this often
 
 # ---- Flask App Setup ----
 # Moved initialization after client setup to ensure clients are attempted first
 
 # ---- Google Cloud Clients ----
-# Initialize as None at the top level. Actual initialization will be deferred.
-secret_manager_client = None
-storage_client = None
-print(f"--- Top-level script execution (LOCAL_MODE={LOCAL_MODE}) ---", flush=True) # <<< MODIFIED
+# The google.cloud modules are imported inside the functions that use them, and the clients
+# are created on first use (see get_gcp_clients), so cold starts and the health check don't
+# pay for grpc/protobuf initialization. cryptography is still loaded at import time through
+# src.clients and src.key_loader.
+_gcp_clients = {}
+_gcp_clients_lock = threading.Lock()
+# (secret_id, version_id) -> (monotonic fetch time, payload)
+_SECRET_CACHE = {}
+# Environment -> KalshiHttpClient; reusing the client keeps its pooled HTTP connections warm.
+# Cleared on SIGHUP so rotated keys are picked up (key_loader caches parsed PEMs by content/mtime).
+_kalshi_clients = {}
+# market_ticker -> hash of the last saved snapshot (see market_snapshot_hash)
+_LAST_HASH = {}
+_last_hash_lock = threading.Lock()
+_last_hash_changed = False # Whether _LAST_HASH differs from the manifest in GCS
 
 # Removed top-level client initialization block
 
-print("--- Flask App Initialization START ---", flush=True) # <<< ADDED
 try:
     app = Flask(__name__)
-    print("--- Flask App Initialization SUCCESS ---", flush=True) # <<< ADDED
 except Exception as e:
-    print(f"--- CRITICAL ERROR initializing Flask app: {e} ---", flush=True) # <<< ADDED
-    print(traceback.format_exc(), flush=True) # <<< ADDED
+    logger.critical("Failed to initialize Flask app: %s", e, exc_info=True)
     raise SystemExit("Failed to initialize Flask app") # Force exit if Flask fails
 
+def get_gcp_clients():
+    """Return the shared Secret Manager and Storage clients, creating them on first use."""
+    with _gcp_clients_lock:
+        if not _gcp_clients:
+            import google.cloud.secretmanager as secretmanager
+            from google.cloud import storage
+            from requests.adapters import HTTPAdapter
+            storage_client = storage.Client()
+            # The default pool keeps 10 connections; match it to the upload threads so they don't churn
+            adapter = HTTPAdapter(pool_connections=GCS_UPLOAD_MAX_WORKERS, pool_maxsize=GCS_UPLOAD_MAX_WORKERS)
+            storage_client._http.mount("https://", adapter)
+            # Build both before publishing either, so a failure leaves nothing half-initialized
+            clients = {
+                'secret_manager': secretmanager.SecretManagerServiceClient(),
+                'storage': storage_client,
+            }
+            _gcp_clients.update(clients)
+            logger.info("Initialized Google Cloud clients.")
+    return _gcp_clients
+
 # ---- Secret Manager Functions ----
 def access_secret_version(secret_id, version_id="latest"):
     """Access a secret stored in Google Cloud Secret Manager."""
     if LOCAL_MODE:
         logger.error("Secret Manager access is not supported in LOCAL_MODE.")
         raise NotImplementedError("Secret Manager access is disabled in LOCAL_MODE.")
-    if not secret_manager_client:
-        raise RuntimeError("Secret Manager client not initialized.")
+
+    cache_key = (secret_id, version_id)
+    cached = _SECRET_CACHE.get(cache_key)
+    if cached and time.monotonic() - cached[0] < SECRET_CACHE_TTL_SECONDS:
+        return cached[1]
+
+    from google.api_core import exceptions as gcp_exceptions
+    secret_manager_client = get_gcp_clients()['secret_manager']
 
     project_id = os.getenv("GOOGLE_CLOUD_PROJECT") # Use standard Cloud Run env var
     if not project_id:
@@ -75,14 +122,24 @@ def access_secret_version(secret_id, version_id="latest"):
         response = secret_manager_client.access_secret_version(name=name)
         logger.info(f"Successfully accessed secret: {secret_id}")
         # Decode and strip leading/trailing whitespace (like newlines)
-        return response.payload.data.decode("UTF-8").strip()
+        payload = response.payload.data.decode("UTF-8").strip()
+        _SECRET_CACHE[cache_key] = (time.monotonic(), payload)
+        return payload
+    except (gcp_exceptions.PermissionDenied, gcp_exceptions.NotFound) as e:
+        # Secret was revoked or removed; don't keep serving a stale copy
+        _SECRET_CACHE.pop(cache_key, None)
+        logger.error(f"Failed to access secret {secret_id} in project {project_id}: {e}")
+        raise
     except Exception as e:
         logger.error(f"Failed to access secret {secret_id} in project {project_id}: {e}")
         raise  # Re-raise the exception
 
 # ---- Kalshi Client Functions ----
 def load_client(env=Environment.PROD):
-    """Initialize the Kalshi HTTP client with appropriate credentials."""
+    """Return the Kalshi HTTP client for env, initializing it with appropriate credentials on first use."""
+    if env in _kalshi_clients:
+        return _kalshi_clients[env]
+
     # Use the global LOCAL_MODE constant
     logger.info(f"Initializing Kalshi client in {'local' if LOCAL_MODE else 'gcloud'} mode for environment: {env.value}")
 
@@ -110,11 +167,7 @@ def load_client(env=Environment.PROD):
             else:
                  raise ValueError(f"Unsupported environment for local mode: {env}")
 
-            with open(keyfile_path, "rb") as key_file:
-                private_key = serialization.load_pem_private_key(
-                    key_file.read(),
-                    password=None  # Assuming key is not password protected
-                )
+            private_key = load_key(keyfile_path)
 
         else:
             # Cloud mode - load keys from Secret Manager
@@ -126,13 +179,11 @@ def load_client(env=Environment.PROD):
                 logger.error("Demo environment not currently configured for GCP Secret Manager")
                 raise NotImplementedError("Demo environment secrets not configured in GCP")
             elif env == Environment.PROD:
-                key_id = access_secret_version("prod-keyid")
-                private_key_pem = access_secret_version("prod-keyfile")
+                # The two reads are independent, so issue them concurrently (one RTT instead of two)
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    key_id, private_key_pem = executor.map(access_secret_version, ["prod-keyid", "prod-keyfile"])
                 logger.info("Loading PROD credentials from Secret Manager")
-                private_key = serialization.load_pem_private_key(
-                    private_key_pem.encode('utf-8'),
-                    password=None
-                )
+                private_key = load_private_key(private_key_pem.encode('utf-8'))
             else:
                  raise ValueError(f"Unsupported environment for gcloud mode: {env}")
 
@@ -148,6 +199,7 @@ def load_client(env=Environment.PROD):
 
         logger.info("Kalshi client initialized | Environment: %s | API endpoint: %s",
                   env.value, client.base_url)
+        _kalshi_clients[env] = client
         return client
 
     except FileNotFoundError as e:
@@ -157,284 +209,604 @@ def load_client(env=Environment.PROD):
         logger.error(f"Failed to initialize Kalshi client: {type(e).__name__} - {str(e)}")
         raise # Re-raise the exception
 
+def clear_credential_caches(signum=None, frame=None):
+    """Drop cached Kalshi clients, credentials and secrets so the next load_client call re-reads them."""
+    _kalshi_clients.clear()
+    _SECRET_CACHE.clear()
+    logger.info("Cleared cached credentials.")
+
+try:
+    signal.signal(signal.SIGHUP, clear_credential_caches) # e.g. `kill -HUP <pid>` after rotating keys
+except (AttributeError, ValueError):
+    # SIGHUP doesn't exist on Windows, and handlers can only be installed from the main thread
+    logger.warning("Could not install SIGHUP handler; cached credentials will not be invalidated by signal.")
+
 # ---- Data Loading/Saving Functions ----
 def load_tickers(file=TICKER_FILE):
-    """Load ticker symbols from file."""
+    """Yield unique ticker symbols from file, in file order."""
     try:
-        with open(file) as f:
-            tickers = [line.strip() for line in f if line.strip()]
-            logger.info(f"Loaded {len(tickers)} tickers from {file}")
-            return tickers
+        # The file is small, so one read and a bytes split beat iterating buffered text lines
+        with open(file, 'rb') as f:
+            lines = f.read().splitlines()
     except FileNotFoundError:
         logger.error(f"Ticker file not found: {file}")
         raise # Stop execution if ticker file is missing
+    seen = set()
+    for line in lines:
+        ticker = line.strip().decode('utf-8')
+        if ticker and ticker not in seen:
+            seen.add(ticker)
+            yield ticker
+    logger.info(f"Loaded {len(seen)} tickers from {file}")
+
+def market_snapshot_hash(market):
+    """Hash a market snapshot, ignoring fetch_timestamp, so unchanged markets can be skipped."""
+    snapshot = {k: v for k, v in market.items() if k != 'fetch_timestamp'}
+    return hashlib.blake2b(orjson.dumps(snapshot, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+def market_unchanged(market_ticker, snapshot_hash):
+    """Return True if snapshot_hash matches the last saved snapshot, marking the entry as recently used."""
+    with _last_hash_lock:
+        if _LAST_HASH.get(market_ticker) != snapshot_hash:
+            return False
+        _LAST_HASH[market_ticker] = _LAST_HASH.pop(market_ticker) # Re-insert so eviction order is LRU
+        return True
+
+def remember_market_hash(market_ticker, snapshot_hash):
+    """Record the hash of a successfully saved snapshot, evicting the least recently used entry when full."""
+    global _last_hash_changed
+    with _last_hash_lock:
+        if _LAST_HASH.pop(market_ticker, None) != snapshot_hash:
+            _last_hash_changed = True
+        if len(_LAST_HASH) >= MAX_TRACKED_MARKET_HASHES:
+            del _LAST_HASH[next(iter(_LAST_HASH))]
+        _LAST_HASH[market_ticker] = snapshot_hash
+
+def load_market_hash_manifest(bucket):
+    """Seed _LAST_HASH from the manifest written by the previous run (Cloud Run instances are short-lived)."""
+    global _last_hash_changed
+    from google.api_core import exceptions as gcp_exceptions
+    for manifest_name in (MARKET_HASH_MANIFEST, LEGACY_MARKET_HASH_MANIFEST):
+        try:
+            _LAST_HASH.update(orjson.loads(bucket.blob(manifest_name).download_as_bytes()))
+            logger.info("Loaded %s market hashes from gs://%s/%s", len(_LAST_HASH), GCS_BUCKET_NAME, manifest_name)
+            _last_hash_changed = manifest_name != MARKET_HASH_MANIFEST # Rewrite a legacy manifest at the new path
+            return
+        except gcp_exceptions.NotFound:
+            continue
+        except Exception as e:
+            logger.warning("Could not load market hash manifest, all markets will be saved: %s", e)
+            return
+    logger.info("No market hash manifest found; all markets will be saved.")
+
+def legacy_history_to_ndjson(data):
+    """Convert a legacy <market>.json history (a JSON list of snapshots) into NDJSON bytes."""
+    records = orjson.loads(data)
+    if isinstance(records, dict):
+        records = [records]
+    return b"".join(orjson.dumps(record) + b"\n" for record in records)
+
+def migrate_legacy_local_history(market_file_local):
+    """Convert a legacy <market>.json next to market_file_local into the start of the NDJSON history, once."""
+    legacy_file = market_file_local[:-len(".ndjson")] + ".json"
+    if os.path.exists(market_file_local) or not os.path.exists(legacy_file):
+        return
+    try:
+        with open(legacy_file, 'rb') as f:
+            payload = legacy_history_to_ndjson(f.read())
+        with open(market_file_local, 'xb') as f:
+            f.write(payload)
+        os.remove(legacy_file)
+        logger.info("Migrated legacy history %s to %s", legacy_file, market_file_local)
+    except Exception as e:
+        logger.warning("Could not migrate legacy history %s, leaving it in place: %s", legacy_file, e)
+
+def save_market_hash_manifest(bucket):
+    """Persist _LAST_HASH so the next instance can skip markets that haven't changed; a no-op if no hash changed."""
+    global _last_hash_changed
+    with _last_hash_lock:
+        if not _last_hash_changed:
+            return
+        payload = orjson.dumps(_LAST_HASH)
+        _last_hash_changed = False
+    try:
+        blob = bucket.blob(MARKET_HASH_MANIFEST)
+        blob.content_encoding = 'gzip' # Transparently decompressed again by download_as_bytes
+        blob.upload_from_string(gzip.compress(payload, compresslevel=1), content_type='application/json')
+    except Exception as e:
+        with _last_hash_lock:
+            _last_hash_changed = True # Try again after the next run
+        logger.warning("Could not save market hash manifest: %s", e)
+
+def save_last_run_marker(bucket, fetch_timestamp_str):
+    """Record when markets were last checked, since unchanged markets keep their older fetch_timestamp."""
+    try:
+        if bucket is None:
+            os.makedirs(MARKET_DATA_DIR, exist_ok=True)
+            with open(os.path.join(MARKET_DATA_DIR, LAST_RUN_MARKER), 'w') as f:
+                f.write(fetch_timestamp_str)
+        else:
+            bucket.blob(f"{GCS_BASE_PATH}/{LAST_RUN_MARKER}").upload_from_string(fetch_timestamp_str, content_type='text/plain')
+    except Exception as e:
+        logger.warning("Could not save last run marker: %s", e)
+
+def upload_staged_blobs(pending_uploads):
+    """Upload staged (blob, payload, market_ticker, snapshot_hash) entries to GCS concurrently.
+
+    Returns (uploaded_entries, failed).
+    """
+    from google.cloud.storage import transfer_manager
+    results = transfer_manager.upload_many(
+        [(io.BytesIO(payload), blob) for blob, payload, _, _ in pending_uploads],
+        upload_kwargs={
+            'content_type': 'application/x-ndjson',
+            'retry': None, # Don't stall the batch on backoff; failures are counted and retried next run
+            'timeout': GCS_UPLOAD_TIMEOUT_SECONDS
+        },
+        worker_type=transfer_manager.THREAD,
+        max_workers=GCS_UPLOAD_MAX_WORKERS,
+        raise_exception=False
+    )
+
+    uploaded_entries = []
+    failed = 0
+    for entry, result in zip(pending_uploads, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to upload market snapshot to GCS gs://%s/%s: %s", GCS_BUCKET_NAME, entry[0].name, result)
+            failed += 1
+        else:
+            uploaded_entries.append(entry)
+    return uploaded_entries, failed
+
+def delete_blobs(bucket, blobs):
+    """Delete blobs using batched requests."""
+    for start in range(0, len(blobs), GCS_BATCH_SIZE):
+        chunk = blobs[start:start + GCS_BATCH_SIZE]
+        try:
+            with bucket.client.batch():
+                for blob in chunk:
+                    blob.delete()
+        except Exception as e:
+            logger.warning("Could not delete %s snapshot record blobs: %s", len(chunk), e)
+
+def fetch_blob_generations(bucket, blob_names):
+    """Return {blob_name: generation} using batched metadata requests.
+
+    Missing (404) blobs map to 0, the if_generation_match value for "must not exist".
+    Any other failure maps to None (unknown), so callers re-read the generation.
+    """
+    generations = {}
+    for start in range(0, len(blob_names), GCS_BATCH_SIZE):
+        probes = [bucket.blob(name) for name in blob_names[start:start + GCS_BATCH_SIZE]]
+        try:
+            with bucket.client.batch(raise_exception=False) as batch:
+                for probe in probes:
+                    probe.reload()
+        except Exception as e:
+            logger.warning("Batched metadata check failed for %s blobs: %s", len(probes), e)
+            generations.update((probe.name, None) for probe in probes)
+            continue
+        # Sub-responses come back in request order; a failed one leaves its probe unresolved.
+        # Batch has no public per-request result, so this reads _responses (google-cloud-storage
+        # is pinned in requirements.txt, and tests/test_data_fetcher.py covers the mapping). If the
+        # attribute ever goes missing, every generation degrades to unknown rather than wrong.
+        responses = getattr(batch, '_responses', None) or []
+        if len(responses) != len(probes):
+            logger.warning("Batched metadata check returned %s results for %s blobs", len(responses), len(probes))
+            generations.update((probe.name, None) for probe in probes)
+            continue
+        for probe, response in zip(probes, responses):
+            if 200 <= response.status_code < 300:
+                generations[probe.name] = probe.generation
+            elif response.status_code == 404:
+                generations[probe.name] = 0
+            else:
+                generations[probe.name] = None
+    return generations
+
+def compose_onto_history(bucket, history_blob, record_blob, generation):
+    """Append record_blob to history_blob, conditional on the history's generation.
+
+    generation is the history's current generation (0 if it doesn't exist, None if unknown).
+    If another writer changes the history first, the generation is re-read and the compose
+    retried, so a concurrent append is never overwritten.
+    """
+    from google.api_core import exceptions as gcp_exceptions
+    for attempt in range(1, HISTORY_COMPOSE_ATTEMPTS + 1):
+        if generation is None:
+            current = bucket.get_blob(history_blob.name)
+            generation = current.generation if current else 0
+        try:
+            if generation == 0:
+                history_blob.compose([record_blob], if_generation_match=0) # First snapshot for this market
+            else:
+                history_blob.compose([history_blob, record_blob], if_generation_match=generation)
+            return
+        except (gcp_exceptions.PreconditionFailed, gcp_exceptions.NotFound):
+            if attempt == HISTORY_COMPOSE_ATTEMPTS:
+                raise
+            logger.debug("History %s changed during append (attempt %s), retrying", history_blob.name, attempt)
+            generation = None
+
+def migrate_legacy_gcs_history(bucket, history_blob, legacy_name):
+    """Seed a new NDJSON history from the market's legacy <market>.json list.
+
+    Returns the history's new generation, or None if it is unknown (another writer created
+    it first, or the legacy list is unreadable and is left behind). Transfer errors are
+    raised so the append fails and the migration is retried next run.
+    """
+    from google.api_core import exceptions as gcp_exceptions
+    legacy_records = bucket.blob(legacy_name).download_as_bytes()
+    try:
+        payload = gzip.compress(legacy_history_to_ndjson(legacy_records), compresslevel=1)
+    except ValueError as e:
+        logger.warning("Could not parse legacy history gs://%s/%s, leaving it in place: %s", GCS_BUCKET_NAME, legacy_name, e)
+        return None
+    try:
+        history_blob.upload_from_string(payload, content_type='application/x-ndjson', if_generation_match=0)
+    except gcp_exceptions.PreconditionFailed:
+        return None
+    logger.info("Migrated legacy history gs://%s/%s to %s", GCS_BUCKET_NAME, legacy_name, history_blob.name)
+    return history_blob.generation
+
+def append_record_to_history(bucket, record_blob, history_name, generation, legacy_generation):
+    """Migrate (if needed) and compose one market's snapshot onto its history. Raises on failure."""
+    history_blob = bucket.blob(history_name)
+    history_blob.content_type = 'application/x-ndjson'
+    history_blob.content_encoding = 'gzip' # Concatenated gzip members still decode as one stream
+    legacy_name = history_name[:-len(".ndjson")] + ".json"
+    if generation is None: # Probe failed; resolve it so a missing history still gets its migration
+        current = bucket.get_blob(history_name)
+        generation = current.generation if current else 0
+    if generation == 0:
+        if legacy_generation is None: # Probe failed; check directly rather than skip the migration
+            legacy_blob = bucket.get_blob(legacy_name)
+            legacy_generation = legacy_blob.generation if legacy_blob else 0
+        if legacy_generation:
+            generation = migrate_legacy_gcs_history(bucket, history_blob, legacy_name)
+    compose_onto_history(bucket, history_blob, record_blob, generation)
+
+def append_records_to_histories(bucket, uploaded_entries):
+    """Compose each uploaded snapshot blob onto the end of its market's NDJSON history.
+
+    Only the new snapshot is transferred; the history itself is never downloaded or
+    re-uploaded. A market's first append migrates its legacy <market>.json history, if
+    any. Markets are appended concurrently (each is a few dependent GCS round trips).
+    Snapshot blobs are deleted afterwards, including ones whose compose failed: their
+    hash isn't remembered, so the next run saves the market again. Returns (appended, failed).
+    """
+    # <prefix>/<market>/<timestamp>.ndjson -> <prefix>/<market>.ndjson
+    history_names = [record_blob.name.rsplit('/', 1)[0] + ".ndjson" for record_blob, *_ in uploaded_entries]
+    generations = fetch_blob_generations(bucket, history_names)
+    # Histories that don't exist yet may still have a pre-NDJSON <market>.json list to carry over
+    legacy_names = [name[:-len(".ndjson")] + ".json" for name in history_names if generations.get(name) == 0]
+    legacy_generations = fetch_blob_generations(bucket, legacy_names)
+
+    def append_entry(entry, history_name):
+        record_blob, _, market_ticker, snapshot_hash = entry
+        try:
+            append_record_to_history(bucket, record_blob, history_name, generations.get(history_name),
+                                     legacy_generations.get(history_name[:-len(".ndjson")] + ".json"))
+        except Exception as e:
+            logger.error("Failed to append snapshot gs://%s/%s to %s: %s", GCS_BUCKET_NAME, record_blob.name, history_name, e)
+            return False
+        logger.debug("Appended market data to GCS: gs://%s/%s", GCS_BUCKET_NAME, history_name)
+        remember_market_hash(market_ticker, snapshot_hash)
+        return True
+
+    # Same bound as the upload, so the storage client's connection pool is never oversubscribed
+    with ThreadPoolExecutor(max_workers=GCS_UPLOAD_MAX_WORKERS) as executor:
+        results = list(executor.map(append_entry, uploaded_entries, history_names))
+    appended = sum(results)
+
+    delete_blobs(bucket, [record_blob for record_blob, *_ in uploaded_entries])
+    return appended, len(results) - appended
+
+def fetch_markets_by_ticker(client, market_tickers):
+    """Fetch single-market tickers with batched comma-separated get_markets calls.
+
+    Returns {ticker: market or None}. Tickers from a failed batch are left out so the
+    caller can fall back to per-ticker requests for them.
+    """
+    markets_by_ticker = {}
+    for i in range(0, len(market_tickers), MARKET_TICKER_BATCH_SIZE):
+        batch = market_tickers[i:i + MARKET_TICKER_BATCH_SIZE]
+        try:
+            returned = {market.get('ticker'): market for market in client.get_markets(tickers=",".join(batch))}
+        except Exception as e:
+            logger.warning("Batched fetch of %s market tickers failed, falling back to per-ticker requests: %s", len(batch), e)
+            continue
+        for ticker in batch:
+            markets_by_ticker[ticker] = returned.get(ticker)
+    return markets_by_ticker
 
 def fetch_and_save_markets(client, tickers):
     """Fetch market data for tickers and save to structured JSON files."""
     fetch_time = datetime.now(timezone.utc)
     fetch_timestamp_str = fetch_time.strftime('%Y-%m-%dT%H:%M:%SZ')
-    logger.info(f"Starting market data fetch at {fetch_timestamp_str}")
-
-    saved_count = 0
-    error_count = 0
-
-    for ticker_input in tickers:
-        ticker_type = detect_ticker_type(ticker_input)
+    logger.info("Starting market data fetch at %s", fetch_timestamp_str)
+
+    event_cache = {} # event_ticker -> series_ticker from get_event (None if the lookup failed)
+    market_paths = {} # (series_ticker, event_ticker) -> local dir or GCS blob prefix
+    created_dirs = set() # Local dirs already passed to os.makedirs this run
+    seen_markets = set() # Markets already handled this run (a series and one of its events can overlap)
+    seen_markets_lock = threading.Lock()
+    bucket = None if LOCAL_MODE else get_gcp_clients()['storage'].bucket(GCS_BUCKET_NAME)
+    if bucket is not None and not _LAST_HASH:
+        load_market_hash_manifest(bucket)
+
+    # Classify each distinct ticker once up front (dict keeps input order and drops repeats)
+    ticker_types = {ticker: detect_ticker_type(ticker) for ticker in tickers}
+    # Series/event filters take a single value, but market tickers can be queried many per request
+    batched_markets = fetch_markets_by_ticker(
+        client, [ticker for ticker, ticker_type in ticker_types.items() if ticker_type == 'market'])
+
+    def lookup_series_ticker(event_ticker):
+        """Resolve an event's series_ticker via get_event, at most once per event per run."""
+        if event_ticker in event_cache:
+            return event_cache[event_ticker]
+        series_ticker = None
+        try:
+            event_details = client.get_event(event_ticker=event_ticker)
+            if event_details and 'event' in event_details and 'series_ticker' in event_details['event']:
+                series_ticker = event_details['event']['series_ticker']
+                logger.debug("Found series_ticker '%s' for event %s", series_ticker, event_ticker)
+            else:
+                logger.warning("get_event response for %s missing expected structure or series_ticker. Response: %s", event_ticker, event_details)
+        except Exception as event_err:
+            logger.error("Failed to get event details for %s to find series_ticker: %s", event_ticker, event_err)
+        event_cache[event_ticker] = series_ticker # Failures are cached too so they aren't retried this run
+        return series_ticker
+
+    def process_ticker(ticker_input, ticker_type):
+        """Fetch and save the markets for one input ticker.
+
+        Returns (saved, errors, unchanged, pending_uploads); in GCS mode the staged uploads
+        are sent for the whole run at once after every ticker has been processed.
+        """
+        saved_count = 0
+        error_count = 0
+        unchanged_count = 0
+        pending_uploads = [] # (blob, payload, market_ticker, snapshot_hash)
         markets = []
         try:
-            logger.debug(f"Fetching markets for {ticker_type}: {ticker_input}")
+            logger.debug("Fetching markets for %s: %s", ticker_type, ticker_input)
             if ticker_type == 'series':
                 markets = client.get_markets(series_ticker=ticker_input)
             elif ticker_type == 'event':
                  markets = client.get_markets(event_ticker=ticker_input)
             elif ticker_type == 'market':
-                 # Assuming get_market method exists or get_markets can handle single market tickers
-                 # Adjust if API requires a different method for single market tickers
-                 market_data = client.get_market(ticker=ticker_input) # Hypothetical method
+                 if ticker_input in batched_markets:
+                     market_data = batched_markets[ticker_input]
+                 else:
+                     market_data = client.get_market(ticker=ticker_input) # Batch failed; fetch on its own
                  markets = [market_data] if market_data else []
             else:
-                logger.warning(f"Unknown ticker type for {ticker_input}, skipping.")
-                continue
+                logger.warning("Unknown ticker type for %s, skipping.", ticker_input)
+                return saved_count, error_count, unchanged_count, pending_uploads
+
+            logger.info("Fetched %s markets for ticker %s", len(markets), ticker_input)
 
-            logger.info(f"Fetched {len(markets)} markets for ticker {ticker_input}")
+            # Determine the correct series/event based on the INPUT ticker type (same for every market)
+            series_ticker_from_input = ticker_input if ticker_type == 'series' else None
+            event_ticker_from_input = ticker_input if ticker_type == 'event' else None
+            needs_series_lookup = series_ticker_from_input is None
 
             for market in markets:
                 try:
-                    # Determine the correct series/event based on the INPUT ticker type
-                    series_ticker_from_input = ticker_input if ticker_type == 'series' else None
-                    event_ticker_from_input = ticker_input if ticker_type == 'event' else None
+                    market_ticker = market.get('ticker')
+                    if not market_ticker:
+                        logger.warning("Market data missing 'ticker' field for item under %s", ticker_input)
+                        continue
 
-                    # Determine the correct series/event based on the INPUT ticker type
-                    series_ticker_from_input = ticker_input if ticker_type == 'series' else None
-                    event_ticker_from_input = ticker_input if ticker_type == 'event' else None
+                    # Only one worker may append to a given market's history per run; claim it before
+                    # any get_event lookup so a market listed under two inputs is only resolved once
+                    with seen_markets_lock:
+                        if market_ticker in seen_markets:
+                            logger.debug("Market %s already handled this run via another ticker, skipping", market_ticker)
+                            continue
+                        seen_markets.add(market_ticker)
+
+                    # Skip the save entirely if nothing but the fetch time would change. Hash the payload
+                    # as the API returned it, so the result doesn't depend on which input claimed the market
+                    snapshot_hash = market_snapshot_hash(market)
+                    if market_unchanged(market_ticker, snapshot_hash):
+                        logger.debug("Market %s unchanged since last save, skipping", market_ticker)
+                        unchanged_count += 1
+                        continue
 
                     # Get initial values from market data or input
                     series_ticker = series_ticker_from_input or market.get('series_ticker')
                     event_ticker = event_ticker_from_input or market.get('event_ticker')
-                    market_ticker = market.get('ticker')
 
                     # --- Fallback logic for missing series_ticker ---
-                    if not series_ticker and event_ticker:
-                        logger.debug(f"Market {market_ticker} missing series_ticker, attempting fallback via get_event({event_ticker})")
-                        try:
-                            event_details = client.get_event(event_ticker=event_ticker)
-                            if event_details and 'event' in event_details and 'series_ticker' in event_details['event']:
-                                series_ticker = event_details['event']['series_ticker']
-                                logger.debug(f"Found series_ticker '{series_ticker}' for event {event_ticker}")
-                                # Optionally add the found series_ticker back to the market data dict
-                                market['series_ticker'] = series_ticker
-                            else:
-                                logger.warning(f"get_event response for {event_ticker} missing expected structure or series_ticker. Response: {event_details}")
-                        except Exception as event_err:
-                            logger.error(f"Failed to get event details for {event_ticker} to find series_ticker: {event_err}")
+                    if needs_series_lookup and not series_ticker and event_ticker:
+                        logger.debug("Market %s missing series_ticker, attempting fallback via get_event(%s)", market_ticker, event_ticker)
+                        series_ticker = lookup_series_ticker(event_ticker)
                     # --- End Fallback logic ---
 
+                    # Store the resolved series_ticker the same way whichever input type found the market
+                    if series_ticker and not market.get('series_ticker'):
+                        market['series_ticker'] = series_ticker
+
                     # Use defaults if still missing after fallback
                     series_ticker = series_ticker or 'unknown_series'
                     event_ticker = event_ticker or 'unknown_event'
-                    market_ticker = market_ticker or 'unknown_market'
-
-
-                    if market_ticker == 'unknown_market':
-                        logger.warning(f"Market data missing 'ticker' field for item under {ticker_input}. Data: {market}")
-                        continue
 
                     # Add fetch timestamp
                     market['fetch_timestamp'] = fetch_timestamp_str
 
                     # --- Saving Logic (Append Mode) ---
-                    market_data_list = []
-                    if LOCAL_MODE:
-                        # Append locally
-                        market_dir_local = os.path.join(MARKET_DATA_DIR, series_ticker, event_ticker)
-                        market_file_local = os.path.join(market_dir_local, f"{market_ticker}.json")
-                        os.makedirs(market_dir_local, exist_ok=True)
-                        try:
-                            if os.path.exists(market_file_local):
-                                with open(market_file_local, 'r') as f:
-                                    content = f.read()
-                                    if content: # Avoid error on empty file
-                                        market_data_list = json.loads(content)
-                                        if not isinstance(market_data_list, list):
-                                            logger.warning(f"Existing local file {market_file_local} is not a JSON list. Overwriting.")
-                                            market_data_list = []
-                        except json.JSONDecodeError:
-                            logger.warning(f"Could not decode JSON from existing local file {market_file_local}. Overwriting.")
-                            market_data_list = []
-                        except Exception as read_err:
-                             logger.error(f"Error reading local file {market_file_local}: {read_err}. Overwriting.")
-                             market_data_list = []
-
-                        market_data_list.append(market) # Append the new market data
+                    # Markets of one event share a directory/prefix, so build it once per (series, event)
+                    market_path_prefix = market_paths.get((series_ticker, event_ticker))
+                    if market_path_prefix is None:
+                        if LOCAL_MODE:
+                            market_path_prefix = os.path.join(MARKET_DATA_DIR, series_ticker, event_ticker)
+                        else:
+                            market_path_prefix = f"{GCS_BASE_PATH}/{series_ticker}/{event_ticker}/"
+                        market_paths[(series_ticker, event_ticker)] = market_path_prefix
 
+                    if LOCAL_MODE:
+                        # Append locally: one NDJSON line per snapshot, so existing history is never re-read
+                        market_dir_local = market_path_prefix
+                        market_file_local = os.path.join(market_dir_local, market_ticker + ".ndjson")
+                        if market_dir_local not in created_dirs:
+                            os.makedirs(market_dir_local, exist_ok=True)
+                            created_dirs.add(market_dir_local)
                         try:
-                            with open(market_file_local, 'w') as f: # Overwrite with updated list
-                                json.dump(market_data_list, f, indent=2)
-                            logger.debug(f"Appended market data locally to {market_file_local}")
+                            migrate_legacy_local_history(market_file_local)
+                            with open(market_file_local, 'ab') as f:
+                                f.write(orjson.dumps(market) + b"\n")
+                            logger.debug("Appended market data locally to %s", market_file_local)
+                            remember_market_hash(market_ticker, snapshot_hash)
                         except Exception as write_err:
-                             logger.error(f"Error writing local file {market_file_local}: {write_err}")
+                             logger.error("Error writing local file %s: %s", market_file_local, write_err)
                              error_count += 1
                              continue # Skip saved_count increment
 
+                        saved_count += 1
+
                     else:
-                        # Append to GCS
-                        if not storage_client:
-                             logger.error("Storage client not initialized. Cannot save to GCS.")
-                             raise RuntimeError("Storage client not initialized.")
+                        # Append to GCS: upload just this snapshot as a small NDJSON object; it is
+                        # composed onto the market's history once the run's batch is uploaded.
+                        # Stored gzip-encoded; GCS transcodes it back to plain NDJSON for readers.
                         try:
-                            bucket = storage_client.bucket(GCS_BUCKET_NAME)
-                            blob_name = f"{GCS_BASE_PATH}/{series_ticker}/{event_ticker}/{market_ticker}.json"
-                            blob = bucket.blob(blob_name)
-
-                            # Download existing data if blob exists
-                            if blob.exists():
-                                try:
-                                    existing_data_str = blob.download_as_string()
-                                    if existing_data_str:
-                                        market_data_list = json.loads(existing_data_str)
-                                        if not isinstance(market_data_list, list):
-                                            logger.warning(f"Existing GCS blob gs://{GCS_BUCKET_NAME}/{blob_name} is not a JSON list. Overwriting.")
-                                            market_data_list = []
-                                except json.JSONDecodeError:
-                                     logger.warning(f"Could not decode JSON from existing GCS blob gs://{GCS_BUCKET_NAME}/{blob_name}. Overwriting.")
-                                     market_data_list = []
-                                except Exception as download_err:
-                                     logger.error(f"Error downloading GCS blob gs://{GCS_BUCKET_NAME}/{blob_name}: {download_err}. Overwriting.")
-                                     market_data_list = []
-
-                            market_data_list.append(market) # Append the new market data
-
-                            # Upload the updated list, overwriting the blob
-                            blob.upload_from_string(
-                                data=json.dumps(market_data_list, indent=2),
-                                content_type='application/json'
-                            )
-                            logger.debug(f"Appended market data to GCS: gs://{GCS_BUCKET_NAME}/{blob_name}")
-
+                            record_blob = bucket.blob(f"{market_path_prefix}{market_ticker}/{fetch_timestamp_str}.ndjson")
+                            record_blob.content_encoding = 'gzip'
+                            payload = gzip.compress(orjson.dumps(market) + b"\n", compresslevel=1)
+                            pending_uploads.append((record_blob, payload, market_ticker, snapshot_hash))
                         except Exception as gcs_e:
-                            logger.error(f"Failed to append market {market_ticker} to GCS: {gcs_e}")
+                            logger.error("Failed to append market %s to GCS: %s", market_ticker, gcs_e)
                             error_count += 1 # Increment error count for GCS save failure
-                            continue # Skip saved_count increment
-
-                    saved_count += 1
 
                 except Exception as e:
-                    logger.error(f"Failed to process/save market {market.get('ticker', 'N/A')}: {e}")
+                    logger.error("Failed to process/save market %s: %s", market.get('ticker', 'N/A'), e)
                     error_count += 1
 
         except Exception as e:
-            logger.error(f"Failed to fetch markets for {ticker_input}: {str(e)}")
+            logger.error("Failed to fetch markets for %s: %s", ticker_input, e)
             error_count += 1
 
-    logger.info(f"Market data fetch completed. Saved: {saved_count}, Errors: {error_count}")
+        return saved_count, error_count, unchanged_count, pending_uploads
+
+    saved_count = 0
+    error_count = 0
+    unchanged_count = 0
+    pending_uploads = []
+    # Tickers are independent and the work is network-bound, so run them concurrently
+    with ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS) as executor:
+        futures = [executor.submit(process_ticker, ticker_input, ticker_type)
+                   for ticker_input, ticker_type in ticker_types.items()]
+        for future in as_completed(futures):
+            saved, errors, unchanged, staged = future.result()
+            saved_count += saved
+            error_count += errors
+            unchanged_count += unchanged
+            pending_uploads.extend(staged)
+
+    # One bounded upload for the whole run, so concurrency never exceeds GCS_UPLOAD_MAX_WORKERS
+    if pending_uploads:
+        uploaded_entries, failed = upload_staged_blobs(pending_uploads)
+        error_count += failed
+        appended, failed = append_records_to_histories(bucket, uploaded_entries)
+        saved_count += appended
+        error_count += failed
+
+    if bucket is not None:
+        save_market_hash_manifest(bucket)
+    if saved_count or unchanged_count:
+        save_last_run_marker(bucket, fetch_timestamp_str)
+
+    logger.info("Market data fetch completed. Saved: %s (unchanged: %s), Errors: %s", saved_count, unchanged_count, error_count)
     return saved_count, error_count
 
 # ---- Flask HTTP Endpoints ----
 @app.route('/', methods=['GET'])
 def hello_world():
     """Simple endpoint for testing."""
-    print("--- / endpoint START (GET) ---", flush=True) # <<< ADDED (for testing)
     logger.info(f"Received request at root endpoint. Request path: {request.path}")
     return "Kalshi Data Fetcher is running. Trigger /run endpoint via POST.", 200
 
+# Single worker so scheduled runs never overlap; extra triggers queue behind the current run
+_fetch_executor = ThreadPoolExecutor(max_workers=1)
+
+def run_fetch_job(kalshi_env):
+    """Load the client and tickers, then fetch and save markets. Runs on the background executor."""
+    start_time = datetime.now()
+    try:
+        client = load_client(env=kalshi_env) # load_client needs access_secret_version, which needs the client
+        tickers_to_fetch = list(load_tickers()) # Reads from TICKER_FILE in cwd; consumed once for the empty check
+
+        if not tickers_to_fetch:
+            logger.warning("No tickers loaded.")
+            message = "No tickers loaded"
+            saved_count = 0
+            error_count = 0
+        else:
+            saved_count, error_count = fetch_and_save_markets(client, tickers_to_fetch)
+            message = f"Fetch completed. Saved: {saved_count}, Errors: {error_count}"
+
+        end_time = datetime.now()
+        duration = end_time - start_time
+        logger.info(f"Data fetcher run finished in {duration}. {message}")
+        return saved_count, error_count
+
+    except FileNotFoundError:
+        logger.error(f"Critical error: Ticker file '{TICKER_FILE}' not found.", exc_info=True)
+    except NotImplementedError as e:
+        logger.error(f"Configuration error: {e}", exc_info=True)
+    except Exception as e:
+        logger.exception(f"Fetcher run failed with unhandled exception: {type(e).__name__} - {str(e)}", exc_info=True)
+
 @app.route('/run', methods=['POST'])
 def run_fetcher():
-    """Flask endpoint triggered by Cloud Scheduler."""
-    global secret_manager_client, storage_client # Declare intent to modify globals
-    print("--- /run endpoint START (POST) ---", flush=True) # <<< ADDED
+    """Flask endpoint triggered by Cloud Scheduler. Starts a fetch in the background and returns 202."""
     port = os.environ.get("PORT")
     logger.info(f"Received request to run data fetcher. Request path: {request.path}, PORT: {port}")
-    start_time = datetime.now()
 
     try:
         # Log environment variables for debugging
-        print(f"--- Environment variables: {os.environ} ---", flush=True) # <<< ADDED (use print for early debug)
-        logger.info(f"Environment variables: {os.environ}") # Keep logger too
+        logger.debug("Environment variables: %s", os.environ)
 
         # --- Deferred GCP Client Initialization ---
         if not LOCAL_MODE:
-            print("--- Initializing GCP clients inside /run ---", flush=True)
             try:
-                # Initialize only if not already done (though per-request is ok for debug)
-                if secret_manager_client is None:
-                    secret_manager_client = secretmanager.SecretManagerServiceClient()
-                    print("--- Initialized Secret Manager client ---", flush=True)
-                if storage_client is None:
-                    storage_client = storage.Client()
-                    print("--- Initialized Storage client ---", flush=True)
-                logger.info("Initialized Google Cloud clients inside /run.")
-            except Exception as client_init_err:
-                print(f"--- FAILED to initialize GCP clients inside /run: {client_init_err} ---", flush=True)
-                print(traceback.format_exc(), flush=True) # Print full traceback
-                logger.error("Failed to initialize Google Cloud clients inside /run.", exc_info=True)
+                get_gcp_clients() # No-op after the first successful call in this process
+            except Exception:
+                logger.exception("Failed to initialize Google Cloud clients inside /run.")
                 return jsonify({"status": "error", "message": "GCP client initialization failed"}), 500
-        else:
-            print("--- Skipping GCP client init inside /run (LOCAL_MODE=True) ---", flush=True)
         # --- End Deferred Initialization ---
 
-
-        # Attempt to access a secret to verify Secret Manager access (NOW uses the initialized client)
-        print("--- Attempting test secret access ---", flush=True) # <<< ADDED
-        try:
-            # Make sure access_secret_version uses the potentially newly initialized client
-            if not LOCAL_MODE and secret_manager_client is None:
-                 raise RuntimeError("Secret Manager client should have been initialized but is None.")
-            test_secret = access_secret_version("prod-keyid") # This function needs the client
-            print(f"--- Successfully accessed test secret: prod-keyid ---", flush=True) # <<< ADDED
-            logger.info(f"Successfully accessed test secret: prod-keyid")
-        except Exception as secret_err:
-            print(f"--- Failed to access test secret: {type(secret_err).__name__} ---", flush=True) # <<< ADDED
-            logger.error(f"Failed to access test secret: {type(secret_err).__name__}")
-            # Decide if this is fatal - maybe return 500?
-            # return jsonify({"status": "error", "message": f"Failed test secret access: {secret_err}"}), 500
-
-
         # Determine environment (e.g., based on an env var, default to PROD if not set)
         # Note: KALSHI_ENV should be set as an environment variable in Cloud Run
         env_str = os.getenv("KALSHI_ENV", "PROD").upper()
         kalshi_env = Environment.PROD if env_str == "PROD" else Environment.DEMO
         logger.info(f"Using Kalshi environment: {kalshi_env.value}")
 
-        # Client initialization is now handled above within the try block
-
-        client = load_client(env=kalshi_env) # load_client needs access_secret_version, which needs the client
-        tickers_to_fetch = load_tickers() # Reads from TICKER_FILE in cwd
-
-        if not tickers_to_fetch:
-            logger.warning("No tickers loaded.")
-            message = "No tickers loaded"
-            saved_count = 0
-            error_count = 0
-        else:
-            saved_count, error_count = fetch_and_save_markets(client, tickers_to_fetch)
-            message = f"Fetch completed. Saved: {saved_count}, Errors: {error_count}"
-
-        end_time = datetime.now()
-        duration = end_time - start_time
-        logger.info(f"Data fetcher run finished in {duration}. {message}")
+        # The fetch can take minutes; Cloud Scheduler only needs an ACK. Results are logged by run_fetch_job.
+        _fetch_executor.submit(run_fetch_job, kalshi_env)
 
-        # Return success response
         return jsonify({
-            "status": "success",
-            "message": message,
-            "saved_count": saved_count,
-            "error_count": error_count,
-            "duration_seconds": duration.total_seconds()
-        }), 200
+            "status": "accepted",
+            "message": "Fetch started in the background",
+            "environment": kalshi_env.value
+        }), 202
 
-    except FileNotFoundError as e:
-        logger.error(f"Critical error: Ticker file '{TICKER_FILE}' not found.", exc_info=True)
-        return jsonify({"status": "error", "message": f"Ticker file not found: {e}"}), 500
-    except NotImplementedError as e:
-        logger.error(f"Configuration error: {e}", exc_info=True)
-        return jsonify({"status": "error", "message": str(e)}), 500
     except Exception as e:
-        print(f"--- Unhandled exception in /run: {type(e).__name__} - {str(e)} ---", flush=True) # <<< ADDED
-        print(traceback.format_exc(), flush=True) # <<< ADDED
         logger.exception(f"Fetcher run failed with unhandled exception: {type(e).__name__} - {str(e)}", exc_info=True)
         # Return error response
         return jsonify({"status": "error", "message": f"Unhandled exception: {str(e)}"}), 500
 
+# ---- Optional eager initialization ----
+# With PRELOAD_GCP=1 the GCP clients are built while the worker boots rather than on the
+# first /run. They are created in the worker itself: gRPC channels are not fork-safe, so
+# this must not be combined with gunicorn --preload.
+if not LOCAL_MODE and os.getenv("PRELOAD_GCP") == "1":
+    try:
+        get_gcp_clients()
+    except Exception as e:
+        logger.warning("Could not pre-initialize Google Cloud clients; will retry on first /run: %s", e)
+
 # Note: The 'if __name__ == "__main__":' block is removed.
 # Gunicorn will be used to run the Flask app in the Docker container.
 # For local testing (python src/data_fetcher.py), you might add:
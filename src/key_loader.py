@@ -0,0 +1,19 @@
+import functools
+import os
+
+from cryptography.hazmat.primitives import serialization
+
+@functools.lru_cache(maxsize=4)
+def load_private_key(pem_bytes: bytes):
+    """Parse a PEM private key, reusing the parsed key when the same PEM is seen again."""
+    return serialization.load_pem_private_key(pem_bytes, password=None) # Assuming key is not password protected
+
+@functools.lru_cache(maxsize=8)
+def _load_key_file(path: str, mtime: float):
+    with open(path, "rb") as key_file:
+        return load_private_key(key_file.read())
+
+def load_key(path: str):
+    """Read and parse the PEM private key file at path, re-reading it only when the file changes."""
+    path = os.path.expanduser(path)
+    return _load_key_file(path, os.stat(path).st_mtime)
@@ -0,0 +1,36 @@
+import os
+import pytest
+from dotenv import load_dotenv
+from src.clients import CachedKalshiHttpClient, Environment
+from src.key_loader import load_key
+
+load_dotenv()
+
+def make_client(env):
+    """Build a client for env from <ENV>_KEYID / <ENV>_KEYFILE, skipping when they aren't configured."""
+    prefix = env.value.upper()
+    key_id = os.environ.get(f'{prefix}_KEYID')
+    keyfile_path = os.environ.get(f'{prefix}_KEYFILE')
+    if not key_id or not keyfile_path:
+        pytest.skip(f"{prefix} credentials not configured")
+    return CachedKalshiHttpClient(key_id=key_id, private_key=load_key(keyfile_path), environment=env)
+
+# One client per environment for the whole session, so every test shares its warm connection pool
+@pytest.fixture(scope="session")
+def demo_client():
+    return make_client(Environment.DEMO)
+
+@pytest.fixture(scope="session")
+def prod_client():
+    return make_client(Environment.PROD)
+
+# Class-scoped adapters for unittest.TestCase classes, which can't take fixtures as arguments
+@pytest.fixture(scope="class")
+def demo_api(request, demo_client):
+    request.cls.env = Environment.DEMO
+    request.cls.client = demo_client
+
+@pytest.fixture(scope="class")
+def prod_api(request, prod_client):
+    request.cls.env = Environment.PROD
+    request.cls.client = prod_client
@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import orjson
+
+from src.app import read_latest_record, read_market_file
+
+class TestReadMarketFile(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.data_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_latest_record_of_ndjson_history(self):
+        records = [{'ticker': 'A', 'yes_bid': bid} for bid in (1, 2, 3)]
+        path = self.write('A.ndjson', b"".join(orjson.dumps(record) + b"\n" for record in records))
+        self.assertEqual(read_latest_record(path), records[-1])
+        # The trailing newline is optional, and an empty history has no record
+        self.assertEqual(read_latest_record(self.write('B.ndjson', orjson.dumps(records[0]))), records[0])
+        self.assertIsNone(read_latest_record(self.write('C.ndjson', b"")))
+
+    def test_legacy_json_list_yields_newest_snapshot(self):
+        path = self.write('A.json', orjson.dumps([{'yes_bid': 1}, {'yes_bid': 2}]))
+        self.assertEqual(read_market_file(path), {'yes_bid': 2})
+
+if __name__ == '__main__':
+    unittest.main()
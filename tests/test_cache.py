@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from src.cache import CACHE_DIR_ENV, FileCache, cached
+
+class FakeClient:
+    def __init__(self, environment="demo"):
+        self.environment = SimpleNamespace(value=environment)
+        self.calls = 0
+
+    @cached(ttl=60)
+    def get_market(self, ticker):
+        self.calls += 1
+        return {'ticker': ticker, 'call': self.calls}
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def test_round_trip_and_expiry(self):
+        cache = FileCache(self.cache_dir)
+        self.assertEqual(cache.get('get_market', 'k', ttl=60), (False, None))
+        cache.set('get_market', 'k', {'ticker': 'ABC'})
+        self.assertEqual(cache.get('get_market', 'k', ttl=60), (True, {'ticker': 'ABC'}))
+        self.assertEqual(cache.get('get_market', 'k', ttl=-1), (False, None))
+
+    def test_cached_method_reuses_response(self):
+        with mock.patch.dict(os.environ, {CACHE_DIR_ENV: self.cache_dir}):
+            client = FakeClient()
+            first = client.get_market("ABC")
+            self.assertEqual(client.get_market("ABC"), first)
+            self.assertEqual(client.calls, 1)
+            client.get_market("XYZ") # Different arguments are a different entry
+            FakeClient(environment="prod").get_market("ABC") # So is a different environment
+            self.assertEqual(client.calls, 2)
+
+    def test_cached_method_without_cache_dir(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            client = FakeClient()
+            client.get_market("ABC")
+            client.get_market("ABC")
+            self.assertEqual(client.calls, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from unittest import mock
+
+from src.clients import Environment, KalshiHttpClient
+
+def fake_response(status_code, headers=None, body=None):
+    return mock.Mock(status_code=status_code, headers=headers or {}, **{'json.return_value': body})
+
+class TestHttpClientRetry(unittest.TestCase):
+    def setUp(self):
+        self.private_key = mock.Mock(**{'sign.return_value': b"signature"})
+        self.client = KalshiHttpClient("key-id", self.private_key, Environment.DEMO)
+        self.client.session = mock.Mock()
+        patcher = mock.patch('src.clients.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retries_429_and_503_with_fresh_signatures(self):
+        self.client.session.get.side_effect = [
+            fake_response(429, {'Retry-After': '2'}),
+            fake_response(503),
+            fake_response(200, body={'markets': []}),
+        ]
+        self.assertEqual(self.client.get(self.client.markets_url), {'markets': []})
+        self.assertEqual(self.client.session.get.call_count, 3)
+        self.assertEqual(self.private_key.sign.call_count, 3) # Re-signed on every attempt
+        self.sleep.assert_any_call(2.0) # Retry-After honored
+        self.sleep.assert_any_call(self.client.RETRY_BACKOFF_SECONDS * 2) # Backoff for the second attempt
+
+    def test_gives_up_after_max_retries(self):
+        self.client.session.get.return_value = fake_response(503)
+        self.client.get(self.client.markets_url)
+        self.assertEqual(self.client.session.get.call_count, self.client.MAX_RETRIES + 1)
+        self.client.session.get.return_value.raise_for_status.assert_called_once()
+
+    def test_retry_after_is_capped(self):
+        delay = self.client.retry_delay(fake_response(429, {'Retry-After': '86400'}), attempt=0)
+        self.assertEqual(delay, self.client.MAX_RETRY_DELAY_SECONDS)
+
+class TestRateLimit(unittest.TestCase):
+    def test_bursts_then_waits_for_a_token(self):
+        client = KalshiHttpClient("key-id", mock.Mock(), Environment.DEMO)
+        with mock.patch('src.clients.time.monotonic', return_value=client._tokens_updated), \
+             mock.patch('src.clients.time.sleep') as sleep:
+            for _ in range(client.REQUESTS_PER_SECOND):
+                client.rate_limit()
+            sleep.assert_not_called() # A full bucket allows a burst
+            client.rate_limit()
+        sleep.assert_called_once_with(1 / client.REQUESTS_PER_SECOND)
+
+if __name__ == '__main__':
+    unittest.main()
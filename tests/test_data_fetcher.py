@@ -0,0 +1,130 @@
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import orjson
+
+from src import data_fetcher
+
+class FakeBatch:
+    """Stands in for storage.Batch: records sub-responses with the given statuses on exit."""
+    def __init__(self, statuses):
+        self.statuses = statuses
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._responses = [SimpleNamespace(status_code=status) for status in self.statuses]
+
+class FakeBlob:
+    def __init__(self, name, generation=None):
+        self.name = name
+        self.generation = generation
+
+    def reload(self):
+        pass
+
+def fake_bucket(generations, statuses):
+    """A bucket whose blob(name) carries generations[name] and whose batches answer with statuses."""
+    batch = FakeBatch(statuses)
+    return SimpleNamespace(
+        blob=lambda name: FakeBlob(name, generations.get(name)),
+        client=SimpleNamespace(batch=lambda raise_exception=True: batch),
+    )
+
+class TestFetchBlobGenerations(unittest.TestCase):
+    def test_maps_batch_statuses(self):
+        bucket = fake_bucket({'ok': 7}, [200, 404, 503, 403])
+        self.assertEqual(data_fetcher.fetch_blob_generations(bucket, ['ok', 'missing', 'busy', 'denied']),
+                         {'ok': 7, 'missing': 0, 'busy': None, 'denied': None})
+
+    def test_unexpected_batch_results_are_unknown(self):
+        bucket = fake_bucket({'ok': 7}, []) # e.g. a library upgrade stops recording sub-responses
+        self.assertEqual(data_fetcher.fetch_blob_generations(bucket, ['ok']), {'ok': None})
+
+class FakeKalshiClient:
+    """Serves a fixed series listing; each call returns fresh copies, as the API would."""
+    def __init__(self, markets):
+        self.markets = markets
+        self.event_calls = 0
+
+    def get_markets(self, **kwargs):
+        return copy.deepcopy(self.markets)
+
+    def get_event(self, event_ticker):
+        self.event_calls += 1
+        return {'event': {'series_ticker': 'KXTEST'}}
+
+class TestLocalFetchAndSave(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        for patcher in (mock.patch.object(data_fetcher, 'LOCAL_MODE', True),
+                        mock.patch.object(data_fetcher, 'MARKET_DATA_DIR', self.data_dir),
+                        mock.patch.dict(data_fetcher._LAST_HASH, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.market = {'ticker': 'KXTEST-25-A', 'event_ticker': 'KXTEST-25', 'series_ticker': 'KXTEST', 'yes_bid': 40}
+        self.history = os.path.join(self.data_dir, 'KXTEST', 'KXTEST-25', 'KXTEST-25-A.ndjson')
+
+    def read_history(self):
+        with open(self.history, 'rb') as f:
+            return [orjson.loads(line) for line in f.read().splitlines()]
+
+    def test_unchanged_market_is_skipped(self):
+        client = FakeKalshiClient([self.market])
+        self.assertEqual(data_fetcher.fetch_and_save_markets(client, ['KXTEST']), (1, 0))
+        self.assertEqual(data_fetcher.fetch_and_save_markets(client, ['KXTEST']), (0, 0))
+        self.assertEqual(len(self.read_history()), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.data_dir, data_fetcher.LAST_RUN_MARKER)))
+
+        client.markets = [dict(self.market, yes_bid=41)]
+        self.assertEqual(data_fetcher.fetch_and_save_markets(client, ['KXTEST']), (1, 0))
+        self.assertEqual([record['yes_bid'] for record in self.read_history()], [40, 41])
+
+    def test_market_under_series_and_event_is_saved_once(self):
+        client = FakeKalshiClient([{k: v for k, v in self.market.items() if k != 'series_ticker'}])
+        self.assertEqual(data_fetcher.fetch_and_save_markets(client, ['KXTEST', 'KXTEST-25']), (1, 0))
+        self.assertEqual(data_fetcher.fetch_and_save_markets(client, ['KXTEST', 'KXTEST-25']), (0, 0))
+        self.assertEqual(self.read_history()[0]['series_ticker'], 'KXTEST')
+        self.assertLessEqual(client.event_calls, 1) # Only when the event input claims the market first
+
+    def test_legacy_json_history_is_migrated(self):
+        os.makedirs(os.path.dirname(self.history))
+        legacy_file = self.history[:-len(".ndjson")] + ".json"
+        with open(legacy_file, 'wb') as f:
+            f.write(orjson.dumps([dict(self.market, yes_bid=38), dict(self.market, yes_bid=39)]))
+
+        data_fetcher.fetch_and_save_markets(FakeKalshiClient([self.market]), ['KXTEST'])
+        self.assertEqual([record['yes_bid'] for record in self.read_history()], [38, 39, 40])
+        self.assertFalse(os.path.exists(legacy_file))
+
+class TestMarketHashes(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(data_fetcher._LAST_HASH, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_eviction_is_least_recently_used(self):
+        with mock.patch.object(data_fetcher, 'MAX_TRACKED_MARKET_HASHES', 2):
+            data_fetcher.remember_market_hash('A', 'a1')
+            data_fetcher.remember_market_hash('B', 'b1')
+            self.assertTrue(data_fetcher.market_unchanged('A', 'a1')) # A is now the most recently used
+            self.assertFalse(data_fetcher.market_unchanged('B', 'b2'))
+            data_fetcher.remember_market_hash('C', 'c1')
+        self.assertEqual(list(data_fetcher._LAST_HASH), ['A', 'C'])
+
+class TestLoadTickers(unittest.TestCase):
+    def test_dedupes_in_file_order(self):
+        with tempfile.NamedTemporaryFile('wb', suffix='.txt', delete=False) as f:
+            f.write(b"KXB\n\nKXA\n  KXB  \nKXC\n")
+        self.addCleanup(os.remove, f.name)
+        self.assertEqual(list(data_fetcher.load_tickers(f.name)), ['KXB', 'KXA', 'KXC'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,36 +1,46 @@
 import os
-import json
+import orjson
+import pandas as pd
+import pytest
 from dotenv import load_dotenv
 import unittest
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from cryptography.hazmat.primitives import serialization
-from src.clients import KalshiHttpClient, Environment
+from pathlib import Path
 
 load_dotenv()
 
+# Response snapshots under test_outputs/ are opt-in so CI runs skip the disk writes
+SAVE_OUTPUTS = os.environ.get('KALSHI_TEST_SAVE_OUTPUTS', '0') == '1'
+
+# Output files are written on a background thread so disk I/O overlaps the next API call
+_output_writer = ThreadPoolExecutor(max_workers=1)
+
+def save_output(path, data):
+    """Queue data to be written to path as indented JSON; returns the write's future (None if saving is off)."""
+    if not SAVE_OUTPUTS:
+        return None
+    return _output_writer.submit(lambda: path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2)))
+
+@pytest.mark.usefixtures("demo_api") # Sets cls.client to the session-wide DEMO client (see conftest.py)
 class TestMarketAPI(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        """Initialize API client with demo credentials"""
-        cls.env = Environment.DEMO
-        cls.key_id = os.environ.get('DEMO_KEYID')
-        keyfile_path = os.environ.get('DEMO_KEYFILE')
-        keyfile_path = os.path.expanduser(keyfile_path)
-
-        if not cls.key_id or not keyfile_path:
-            raise unittest.SkipTest("DEMO credentials not configured")
-
-        with open(keyfile_path, "rb") as key_file:
-            private_key = serialization.load_pem_private_key(
-                key_file.read(),
-                password=None
-            )
-            
-        cls.client = KalshiHttpClient(
-            key_id=cls.key_id,
-            private_key=private_key,
-            environment=cls.env
-        )
+        """Prepare the demo output directory"""
+        cls.output_dir = Path("test_outputs") / "demo"
+        if SAVE_OUTPUTS:
+            cls.output_dir.mkdir(parents=True, exist_ok=True)
+        cls.pending_writes = []
+
+    def setUp(self):
+        if not hasattr(self, 'client'): # Not collected by pytest, so the fixture never ran
+            self.skipTest("API client comes from the conftest.py fixtures; run with pytest")
+
+    @classmethod
+    def tearDownClass(cls):
+        for write in cls.pending_writes:
+            if write is not None:
+                write.result() # Surface any failed output write
 
     def test_single_series_ticker(self):
         """Test markets endpoint with single series ticker (KXCPIYOY)"""
@@ -43,10 +53,7 @@ class TestMarketAPI(unittest.TestCase):
             self.assertIn('ticker', market)
         
         # Save results
-        output_dir = "test_outputs/demo"
-        os.makedirs(output_dir, exist_ok=True)
-        with open(f"{output_dir}/KXCPIYOY.json", "w") as f:
-            json.dump(response, f, indent=2)
+        self.pending_writes.append(save_output(self.output_dir / "KXCPIYOY.json", response))
 
     def test_multiple_market_tickers(self):
         """Test markets endpoint with multiple series tickers"""
@@ -62,10 +69,7 @@ class TestMarketAPI(unittest.TestCase):
         self.assertTrue(any("FED-23DEC-T3.00" in t for t in tickers))
         self.assertTrue(any("HIGHNY-22DEC23-B53.5" in t for t in tickers))
         
-        output_dir = "test_outputs/demo"
-        os.makedirs(output_dir, exist_ok=True)
-        with open(f"{output_dir}/FED-23DEC-T3.00_HIGHNY-22DEC23-B53.5.json", "w") as f:
-            json.dump(response, f, indent=2)
+        self.pending_writes.append(save_output(self.output_dir / "FED-23DEC-T3.00_HIGHNY-22DEC23-B53.5.json", response))
 
     def test_event_ticker(self):
         """Test markets endpoint with event ticker (KXCPIYOY-25MAR)"""
@@ -78,10 +82,7 @@ class TestMarketAPI(unittest.TestCase):
         for market in response:
             self.assertIn("KXCPIYOY-25MAR", market['ticker'])
         
-        output_dir = "test_outputs/demo"
-        os.makedirs(output_dir, exist_ok=True)
-        with open(f"{output_dir}/KXCPIYOY-25MAR.json", "w") as f:
-            json.dump(response, f, indent=2)
+        self.pending_writes.append(save_output(self.output_dir / "KXCPIYOY-25MAR.json", response))
 
     # def test_get_all_markets(self):
     #     """Test getting all markets with no filters including timing metrics"""
@@ -112,29 +113,25 @@ class TestMarketAPI(unittest.TestCase):
     #             "markets": response
     #         }, f, indent=2)
 
+@pytest.mark.usefixtures("prod_api") # Sets cls.client to the session-wide PROD client (see conftest.py)
 class TestProdMarketAPI(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        """Initialize API client with prod credentials"""
-        cls.env = Environment.PROD
-        cls.key_id = os.environ.get('PROD_KEYID')
-        keyfile_path = os.environ.get('PROD_KEYFILE')
-        keyfile_path = os.path.expanduser(keyfile_path)
-
-        if not cls.key_id or not keyfile_path:
-            raise unittest.SkipTest("PROD credentials not configured")
-
-        with open(keyfile_path, "rb") as key_file:
-            private_key = serialization.load_pem_private_key(
-                key_file.read(),
-                password=None
-            )
-            
-        cls.client = KalshiHttpClient(
-            key_id=cls.key_id,
-            private_key=private_key,
-            environment=cls.env
-        )
+        """Prepare the prod output directory"""
+        cls.output_dir = Path("test_outputs") / "prod"
+        if SAVE_OUTPUTS:
+            cls.output_dir.mkdir(parents=True, exist_ok=True)
+        cls.pending_writes = []
+
+    def setUp(self):
+        if not hasattr(self, 'client'): # Not collected by pytest, so the fixture never ran
+            self.skipTest("API client comes from the conftest.py fixtures; run with pytest")
+
+    @classmethod
+    def tearDownClass(cls):
+        for write in cls.pending_writes:
+            if write is not None:
+                write.result() # Surface any failed output write
 
     def test_single_series_ticker(self):
         """PROD: Test markets endpoint with single series ticker"""
@@ -156,47 +153,45 @@ class TestProdMarketAPI(unittest.TestCase):
     def _validate_and_save(self, response, filename):
         self.assertIsInstance(response, list)
         self.assertGreater(len(response), 0)
-        
-        output_dir = os.path.join("test_outputs", "prod")
-        os.makedirs(output_dir, exist_ok=True)
-        
-        with open(os.path.join(output_dir, filename), "w") as f:
-            json.dump(response, f, indent=2)
+
+        self.pending_writes.append(save_output(self.output_dir / filename, response))
 
     def test_get_all_markets(self):
         """Test getting all markets with no filters including timing metrics"""
         # just test some series I'm interested in
         series_tickers = ["KXCPIYOY", "KXNETFLIXRANKSHOW", "KXNETFLIXRANKMOVIE", "KXOSCARNOMPIC"]
-        for ticker in series_tickers:
-            # response = self.client.get_markets(series_ticker=ticker)
-            # self._validate_and_save(response, f"PROD_{ticker}.json")
-                
+
+        def timed_get_markets(ticker):
             start_time = datetime.now()
             response = self.client.get_markets(series_ticker=ticker)
-            exec_seconds = (datetime.now() - start_time).total_seconds()
-            
-            self.assertIsInstance(response, list)
-            self.assertGreater(len(response), 0)
-            
-            # Validate market structure
-            required_fields = {'ticker', 'status', 'yes_ask', 'no_bid', 'volume'}
-            for market in response:
-                self.assertTrue(required_fields.issubset(market.keys()))
-            
-            # Save with timestamp and metrics
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_dir = os.path.join("test_outputs", "prod")
-            filename = f"{output_dir}/{ticker}_markets_{timestamp}.json"
-            
-            with open(filename, "w") as f:
-                json.dump({
+            return response, (datetime.now() - start_time).total_seconds()
+
+        # The series are independent, so fetch them concurrently over the client's pooled session
+        with ThreadPoolExecutor(max_workers=len(series_tickers)) as executor:
+            futures = {executor.submit(timed_get_markets, ticker): ticker for ticker in series_tickers}
+            for future in as_completed(futures):
+                ticker = futures[future]
+                response, exec_seconds = future.result()
+
+                self.assertIsInstance(response, list)
+                self.assertGreater(len(response), 0)
+
+                # Validate market structure: every field present and populated in every market
+                required_fields = {'ticker', 'status', 'yes_ask', 'no_bid', 'volume'}
+                df = pd.DataFrame(response)
+                self.assertFalse(required_fields - set(df.columns), f"{ticker}: missing market fields")
+                self.assertTrue(df[sorted(required_fields)].notna().all().all(), f"{ticker}: empty market fields")
+
+                # Save with timestamp and metrics
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                self.pending_writes.append(save_output(self.output_dir / f"{ticker}_markets_{timestamp}.json", {
                     "metadata": {
                         "test_run": timestamp,
                         "execution_seconds": exec_seconds,
                         "market_count": len(response)
                     },
                     "markets": response
-                }, f, indent=2)
+                }))
 
-if __name__ == "__main__":
-    unittest.main()
+if __name__ == '__main__':
+    pytest.main([__file__])
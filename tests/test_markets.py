@@ -1,86 +1,55 @@
+import functools
 import os
 from dotenv import load_dotenv
-import json
-import csv
-from cryptography.hazmat.primitives import serialization
-from src.clients import KalshiHttpClient, Environment
-
-load_dotenv()
-
-# Configuration
-env = Environment.DEMO
-key_id = os.environ.get('DEMO_KEYID')
-keyfile_path = os.environ.get('DEMO_KEYFILE')
-keyfile_path = os.path.expanduser(keyfile_path)
-
-if not key_id or not keyfile_path:
-    raise ValueError("DEMO_KEYID and DEMO_KEYFILE environment variables must be set")
-
-# Load private key
-with open(keyfile_path, "rb") as key_file:
-    private_key = serialization.load_pem_private_key(
-        key_file.read(),
-        password=None
-    )
-
-# Initialize client
-http_client = KalshiHttpClient(key_id, private_key, env)
-
-# Test ticker
-test_ticker = "NGDP-22-C7.5"  # Replace with a valid ticker
-
-# Get market data
-market_data = http_client.get_market(test_ticker)
-print(f"Market data for {test_ticker}:")
-print(market_data)
-
-# Get market history
-market_history = http_client.get_market_history(test_ticker)
-print(f"\nMarket history for {test_ticker}:")
-print(market_history)
-
-# Find specific markets
-market_params = {'limit': 10, 'tickers': 'NGDP-22-C7.5,NGDP-22-C8.0'}
-markets_response = http_client.get(http_client.markets_url, params=market_params)
-print(f"\nSpecific markets:")
-print(markets_response)
+import orjson
+import pandas as pd
+from src.clients import CachedKalshiHttpClient, Environment
+from src.key_loader import load_key
+
+@functools.lru_cache(maxsize=None)
+def _env():
+    """Load .env once and return the resulting environment."""
+    load_dotenv()
+    return os.environ
 
 output_dir = "./test_outputs/demo"
-os.makedirs(output_dir, exist_ok=True)
+
 # Save to JSON
 def save_to_json(data, filename=f"{output_dir}/market_history.json"):
-    with open(filename, "w") as f:
-        json.dump(data, f, indent=4)
+    with open(filename, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
 # Save to CSV
 def save_to_csv(data, filename=f"{output_dir}/market_history.csv"):
     trades = data.get('trades', [])
     if trades:
-        with open(filename, "w", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=trades[0].keys())
-            writer.writeheader()
-            writer.writerows(trades)
+        pd.DataFrame(trades).to_csv(filename, index=False)
+
+# The tests take the client as an argument: pytest injects the session-wide
+# demo_client fixture from conftest.py, and main() passes its own client.
 
-save_to_json(market_history)
-save_to_csv(market_history)
+# Series responses are shared between tests, so each ticker is fetched once per client
+@functools.lru_cache(maxsize=32)
+def _series(client, ticker):
+    return client.get_series(ticker)
 
 # Test Series
-def test_series_data():
-    series_data = http_client.get_series("KXNETFLIXRANKSHOW")
+def test_series_data(demo_client):
+    series_data = _series(demo_client, "KXNETFLIXRANKSHOW")
     assert series_data is not None
     assert 'series' in series_data
     assert series_data['series']['ticker'] == "KXNETFLIXRANKSHOW"
 
 # Test Event
-def test_event_data():
-    event_data = http_client.get_event("KXNETFLIXRANKSHOW-25MAR17")
+def test_event_data(demo_client):
+    event_data = demo_client.get_event("KXNETFLIXRANKSHOW-25MAR17")
     assert event_data is not None
     assert 'event' in event_data
     assert event_data['event']['event_ticker'] == "KXNETFLIXRANKSHOW-25MAR17"
 
 # Test Series Markets
-def test_series_markets():
-    series_data = http_client.get_series("KXNETFLIXRANKSHOW")
+def test_series_markets(demo_client):
+    series_data = _series(demo_client, "KXNETFLIXRANKSHOW")
     assert series_data is not None
     assert 'series' in series_data
     if 'markets' in series_data['series']:
@@ -89,6 +58,50 @@ def test_series_markets():
         series_markets = None
     assert series_markets is None or isinstance(series_markets, list)
 
-test_series_data()
-test_event_data()
-test_series_markets()
+def main():
+    # Configuration
+    env = Environment.DEMO
+    key_id = _env().get('DEMO_KEYID')
+    keyfile_path = _env().get('DEMO_KEYFILE')
+
+    if not key_id or not keyfile_path:
+        raise ValueError("DEMO_KEYID and DEMO_KEYFILE environment variables must be set")
+    keyfile_path = os.path.expanduser(keyfile_path)
+
+    # Load private key
+    private_key = load_key(keyfile_path)
+
+    # Initialize client
+    http_client = CachedKalshiHttpClient(key_id, private_key, env)
+
+    # Test ticker
+    test_ticker = "NGDP-22-C7.5"  # Replace with a valid ticker
+
+    # Get market data
+    market_data = http_client.get_market(test_ticker)
+    print(f"Market data for {test_ticker}:")
+    print(market_data)
+
+    # Get market history
+    market_history = http_client.get_market_history(test_ticker)
+    print(f"\nMarket history for {test_ticker}:")
+    print(market_history)
+
+    # Find specific markets
+    market_params = {'limit': 10, 'tickers': 'NGDP-22-C7.5,NGDP-22-C8.0'}
+    markets_response = http_client.get(http_client.markets_url, params=market_params)
+    print(f"\nSpecific markets:")
+    print(markets_response)
+
+    # Response snapshots are opt-in so CI runs skip the disk writes
+    if _env().get('KALSHI_TEST_SAVE_OUTPUTS', '0') == '1':
+        os.makedirs(output_dir, exist_ok=True)
+        save_to_json(market_history)
+        save_to_csv(market_history)
+
+    test_series_data(http_client)
+    test_event_data(http_client)
+    test_series_markets(http_client)
+
+if __name__ == "__main__":
+    main()